@@ -1,5 +1,5 @@
 import streamlit as st
-from main import get_rag_answer, extract_used_sources, formatter
+from main import get_rag_answer_stream, replace_citations_with_author_year, extract_used_sources, formatter
 
 st.set_page_config(page_title="Thesis RAG Chatbot", layout="centered")
 
@@ -23,26 +23,31 @@ if question:
     with st.chat_message("user"):
         st.markdown(question)
 
-    # RAG
-    answer, _, _ = get_rag_answer(question)
-    
-    # Extract references
-    sources = extract_used_sources(answer, formatter)
-    
-    # Build assistant message
-    assistant_content = answer
-    
-    if sources:
-        refs_md = "\n\n---\n**References:**\n"
-        for src in sources:
-            refs_md += f"- {src}\n"
-        assistant_content += refs_md
-    
+    with st.chat_message("assistant"):
+        # RAG: stream the raw answer while it is generated
+        placeholder = st.empty()
+        with placeholder.container():
+            raw_answer = st.write_stream(get_rag_answer_stream(question))
+
+        # Replace citation tags once the stream has finished
+        answer = replace_citations_with_author_year(raw_answer.strip(), formatter)
+
+        # Extract references
+        sources = extract_used_sources(answer, formatter)
+
+        # Build assistant message
+        assistant_content = answer
+
+        if sources:
+            refs_md = "\n\n---\n**References:**\n"
+            for src in sources:
+                refs_md += f"- {src}\n"
+            assistant_content += refs_md
+
+        # Display the final answer in place of the streamed one
+        placeholder.markdown(assistant_content)
+
     # Save message
     st.session_state.messages.append(
         {"role": "assistant", "content": assistant_content}
     )
-    
-    # Display
-    with st.chat_message("assistant"):
-        st.markdown(assistant_content)
@@ -1,50 +1,65 @@
+from contextlib import contextmanager
+from typing import Iterator
+import mmap
+import os
 import re
-import json
+import orjson
 
 # Paths
 main_with_noise_path = "../data/intermediate/main_with_noise.md"
+corpus_noise_path = "../data/intermediate/corpus_noise_inventory.json"
+clean_path = "../data/final/main.md"
 
-# === Load corpus ===
+# Regex (bytes patterns: the corpus is scanned as raw UTF-8, all delimiters are ASCII)
+CURLY_BLOCK_REGEX = re.compile(rb"\{(?!\n)[^}]+\}")
+INTERNAL_LINK_REGEX = re.compile(rb"\[[^\]]*\]\(#.*?\)")
+IMAGE_REGEX = re.compile(rb"!\[[^\]\n]*\]\([^)\n]+\)(?:\{[^{}\n]+\}|\([^()\n]+\))?")
+PARENTHESIZED_REF_REGEX = re.compile(rb"\(#.*?\)")
+DOLLAR_BLOCK_REGEX = re.compile(rb"\$\$.*?\$\$", re.DOTALL)
+FOOTNOTE_REGEX = re.compile(rb"\[\^[0-9][0-9]?\]")
+SQUARE_BRACKET_LABEL_REGEX = re.compile(rb"\\\[(?:fig|app):[^\]]+\\\]")
 
-def load_corpus(main_with_noise_path: str) -> str:
-    """Load main.md as corpus."""
-    with open(main_with_noise_path, "r", encoding="utf-8") as f:
-        return f.read()
+# === Load corpus ===
 
-corpus_text = load_corpus(main_with_noise_path)
+@contextmanager
+def load_corpus(main_with_noise_path: str) -> Iterator[bytes]:
+    """Memory-map main_with_noise.md as corpus (read-only, not decoded); the map is closed when the block exits."""
+    if os.path.getsize(main_with_noise_path) == 0:
+        # mmap cannot map an empty file
+        yield b""
+        return
+    with open(main_with_noise_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        yield mm
 
 # == Extract noise ==
 
-def extract_curly_blocks(text: str):
-    pattern = re.compile(r"\{(?!\n)[^}]+\}")
-    return list(set(pattern.findall(text)))
+def find_unique(pattern: re.Pattern, text: bytes) -> list[str]:
+    """Unique matches of a bytes pattern, decoded to str for the JSON inventory."""
+    return [match.decode("utf-8") for match in set(pattern.findall(text))]
 
-def extract_internal_links(text: str):
-    pattern = re.compile(r"\[[^\]]*\]\(#.*?\)")
-    return list(set(pattern.findall(text)))
+def extract_curly_blocks(text: bytes):
+    return find_unique(CURLY_BLOCK_REGEX, text)
 
-def extract_images_with_attrs(text: str):
-    pattern = re.compile(r"!\[[^\]]*\]\([^)]+\)(?:\{[^}]+\}|\([^)]+\))?")
-    return list(set(pattern.findall(text)))
+def extract_internal_links(text: bytes):
+    return find_unique(INTERNAL_LINK_REGEX, text)
 
-def extract_parenthesized_refs(text: str):
-    pattern = re.compile(r"\(#.*?\)")
-    return list(set(pattern.findall(text)))
+def extract_images_with_attrs(text: bytes):
+    return find_unique(IMAGE_REGEX, text)
 
-def extract_dollar_blocks(text: str):
-    pattern = re.compile(r"\$\$.*\$\$")
-    return list(set(pattern.findall(text)))
+def extract_parenthesized_refs(text: bytes):
+    return find_unique(PARENTHESIZED_REF_REGEX, text)
 
-def extract_footnotes(text: str):
-    pattern = re.compile(r"\[\^[0-9][0-9]?\]")
-    return list(set(pattern.findall(text)))
+def extract_dollar_blocks(text: bytes):
+    return find_unique(DOLLAR_BLOCK_REGEX, text)
 
-def extract_square_bracket_labels(text: str):
-    pattern = re.compile(r"\\\[(?:fig|app):[^\]]+\\\]")
-    return list(set(pattern.findall(text)))
+def extract_footnotes(text: bytes):
+    return find_unique(FOOTNOTE_REGEX, text)
 
+def extract_square_bracket_labels(text: bytes):
+    return find_unique(SQUARE_BRACKET_LABEL_REGEX, text)
 
-def extract_all_noise_patterns(text: str):
+
+def extract_all_noise_patterns(text: bytes):
     noise = {
         "curly_blocks": extract_curly_blocks(text),
         "internal_links": extract_internal_links(text),
@@ -56,17 +71,6 @@ def extract_all_noise_patterns(text: str):
     }
     return noise
 
-# Extract noise patterns
-noise = extract_all_noise_patterns(corpus_text)
-
-# Save noise inventory to file
-corpus_noise_path = "../data/intermediate/corpus_noise_inventory.json"
-
-with open(corpus_noise_path, "w", encoding="utf-8") as f:
-    json.dump(noise, f, indent=2, ensure_ascii=False)
-
-print(f"Saved corpus noise inventory to: {corpus_noise_path}")
-
 # === Remove noise ===
 
 def flatten_noise_inventory(noise_dict):
@@ -75,23 +79,36 @@ def flatten_noise_inventory(noise_dict):
         all_noise.extend(values)
     return sorted(set(all_noise), key=len, reverse=True)
 
-def remove_noise_from_text(text: str, noise_list: list[str]) -> str:
-    for noise in noise_list:
-        text = text.replace(noise, "")
-    return text
+def remove_noise_from_text(text: bytes, noise_list: list[str]) -> bytes:
+    """Remove all noise strings in a single pass (longest alternatives are tried first)."""
+    if not noise_list:
+        return bytes(text)
+    pattern = re.compile(b"|".join(re.escape(noise.encode("utf-8")) for noise in noise_list))
+    return pattern.sub(b"", text)
 
-# Load noise inventory from file
-with open(corpus_noise_path, "r", encoding="utf-8") as f:
-    noise_inventory = json.load(f)
+# === Main ===
 
-# Flatten and clean the text
-noise_list = flatten_noise_inventory(noise_inventory)
-clean_text = remove_noise_from_text(corpus_text, noise_list)
+def main():
+    with load_corpus(main_with_noise_path) as corpus_text:
+        # Extract noise patterns
+        noise = extract_all_noise_patterns(corpus_text)
 
-# Save cleaned text
-clean_path = "../data/final/main.md"
+        # Save noise inventory to file
+        with open(corpus_noise_path, "wb") as f:
+            f.write(orjson.dumps(noise, option=orjson.OPT_INDENT_2))
+
+        print(f"Saved corpus noise inventory to: {corpus_noise_path}")
+
+        # Flatten and clean the text (reuse the in-memory inventory, no reload from disk)
+        noise_list = flatten_noise_inventory(noise)
+        clean_text = remove_noise_from_text(corpus_text, noise_list)
+
+    # Save cleaned text
+    with open(clean_path, "wb") as f:
+        f.write(clean_text)
+
+    print(f"Saved cleaned corpus to: {clean_path}")
 
-with open(clean_path, "w", encoding="utf-8") as f:
-    f.write(clean_text)
 
-print(f"Saved cleaned corpus to: {clean_path}")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
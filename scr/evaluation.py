@@ -1,5 +1,8 @@
-import json
+import hashlib
+import orjson
 import os
+import shelve
+from concurrent.futures import ThreadPoolExecutor
 from datasets import Dataset
 from ragas import evaluate
 from ragas.metrics import (
@@ -12,27 +15,77 @@ from ragas.embeddings import OpenAIEmbeddings
 from openai import OpenAI
 from main import get_rag_answer
 
+# Paths
+embed_cache_path = "../data/eval/embed_cache.db"
+
 # Load evaluation file
-with open("../data/eval/eval_data_final.json", "r", encoding="utf-8") as f:
-    qa_pairs = json.load(f)
+with open("../data/eval/eval_data_final.json", "rb") as f:
+    qa_pairs = orjson.loads(f.read())
 
 
 class RagasEmbeddingWrapper:
+    """
+    Expose ragas embeddings through the embed_query/embed_documents interface.
+    Vectors are cached per text (metrics re-embed the same questions and contexts),
+    and uncached documents are embedded in batches of at most batch_size texts.
+    """
+    batch_size = 256
+
     def __init__(self, embeddings):
         self.embeddings = embeddings
+        self.cache = {}
 
     def embed_query(self, text: str):
-        return self.embeddings.embed_text(text)
+        if text not in self.cache:
+            self.cache[text] = self.embeddings.embed_text(text)
+        return self.cache[text]
 
     def embed_documents(self, texts):
-        return self.embeddings.embed_texts(texts)
+        missing = list(dict.fromkeys(t for t in texts if t not in self.cache))
+        for i in range(0, len(missing), self.batch_size):
+            batch = missing[i:i + self.batch_size]
+            self.cache.update(zip(batch, self.embeddings.embed_texts(batch)))
+        return [self.cache[t] for t in texts]
+
+
+class CachedEmbeddings:
+    """
+    Persistent (shelve) cache in front of ragas embeddings, keyed by the SHA-256
+    of model name + text, so re-running the evaluation does not re-embed unchanged strings.
+    """
+    def __init__(self, inner, path: str):
+        self.inner = inner
+        self.db = shelve.open(path)
+
+    def cache_key(self, text: str) -> str:
+        model = getattr(self.inner, "model", "")
+        return hashlib.sha256(f"{model}\n{text}".encode("utf-8")).hexdigest()
+
+    def embed_text(self, text: str):
+        return self.embed_texts([text])[0]
+
+    def embed_texts(self, texts):
+        keys = [self.cache_key(t) for t in texts]
+
+        missing = {k: t for k, t in zip(keys, texts) if k not in self.db}
+
+        if missing:
+            vectors = self.inner.embed_texts(list(missing.values()))
+            for k, vector in zip(missing, vectors):
+                self.db[k] = vector
+
+        return [self.db[k] for k in keys]
+
+    def close(self):
+        self.db.close()
 
 
 # Embeddings
 client = OpenAI()
 base_embeddings = OpenAIEmbeddings(client=client)
+cached_embeddings = CachedEmbeddings(base_embeddings, embed_cache_path)
 
-embeddings = RagasEmbeddingWrapper(base_embeddings)
+embeddings = RagasEmbeddingWrapper(cached_embeddings)
 
 
 questions = []
@@ -40,13 +93,21 @@ ground_truths = []
 responses = []
 contexts = []
 
-# Run RAG for each question
-for item in qa_pairs:
+# Number of questions run through the RAG pipeline concurrently
+max_workers = 16
+
+def run_rag(item):
+    rag_answer, _, context_for_eval = get_rag_answer(item["question"])
+    return rag_answer, context_for_eval
+
+# Run RAG for each question (network-bound, so threads overlap the API calls)
+with ThreadPoolExecutor(max_workers=max_workers) as executor:
+    rag_results = list(executor.map(run_rag, qa_pairs))
+
+for item, (rag_answer, context_for_eval) in zip(qa_pairs, rag_results):
     q = item["question"]
     gt = item["ground_truth"]
 
-    rag_answer, _, context_for_eval = get_rag_answer(q)
-
     questions.append(q)
     ground_truths.append(gt)
     responses.append(rag_answer)
@@ -60,17 +121,20 @@ ragas_dataset = Dataset.from_dict({
     "ground_truth": ground_truths,
 })
 
-# Evaluate
-results = evaluate(
-    ragas_dataset,
-    metrics=[
-        faithfulness,
-        answer_relevancy,
-        context_precision,
-        context_recall,
-    ],
-    embeddings=embeddings,
-)
+# Evaluate (the embedding shelve is closed even if a metric fails)
+try:
+    results = evaluate(
+        ragas_dataset,
+        metrics=[
+            faithfulness,
+            answer_relevancy,
+            context_precision,
+            context_recall,
+        ],
+        embeddings=embeddings,
+    )
+finally:
+    cached_embeddings.close()
 
 df = results.to_pandas()
 
@@ -20,11 +20,17 @@ metrics = [
 
 x = range(len(df))
 
+# Metric columns, extracted once and reused by all plots
+cols = {m: df[m].to_numpy() for m in metrics}
+
+# Web-bound PNGs: 150 dpi is enough and renders ~4x fewer pixels than 300
+dpi = 150
+
 # === BOXPLOT ===
 
 plt.figure(figsize=(10, 6))
 plt.boxplot(
-    [df[m] for m in metrics],
+    [cols[m] for m in metrics],
     tick_labels=metrics,
     showfliers=True
 )
@@ -34,24 +40,28 @@ plt.ylim(0, 1.05)
 plt.grid(axis="y", linestyle="--", alpha=0.6)
 
 plt.tight_layout()
-plt.savefig(os.path.join(output_dir, "ragas_boxplot.png"), dpi=300)
+plt.savefig(os.path.join(output_dir, "ragas_boxplot.png"), dpi=dpi)
 plt.close()
 
 print(f"Saved boxplot in {output_dir}.")
 
 # === LINE PLOTS ===
 
+# One figure for all metrics: the axes are cleared and redrawn for each plot
+fig, ax = plt.subplots(figsize=(10, 4))
+
 for metric in metrics:
-    plt.figure(figsize=(10, 4))
-    plt.plot(x, df[metric], marker="o", linestyle="-")
-    plt.xlabel("Question index")
-    plt.ylabel(metric)
-    plt.title(f"{metric}")
-    plt.ylim(0, 1.05)
-    plt.grid(axis="y", linestyle="--", alpha=0.6)
-
-    plt.tight_layout()
-    plt.savefig(os.path.join(output_dir, f"{metric}.png"), dpi=300)
-    plt.close()
-
-    print(f"Saved line plots in {output_dir}.")
\ No newline at end of file
+    ax.cla()
+    ax.plot(x, cols[metric], marker="o", linestyle="-")
+    ax.set_xlabel("Question index")
+    ax.set_ylabel(metric)
+    ax.set_title(f"{metric}")
+    ax.set_ylim(0, 1.05)
+    ax.grid(axis="y", linestyle="--", alpha=0.6)
+
+    fig.tight_layout()
+    fig.savefig(os.path.join(output_dir, f"{metric}.png"), dpi=dpi)
+
+plt.close(fig)
+
+print(f"Saved line plots in {output_dir}.")
\ No newline at end of file
@@ -1,6 +1,6 @@
 import anthropic
 import getpass
-import json
+import orjson
 import os
 
 # Ask for API key
@@ -96,7 +96,7 @@ message = client.messages.create(
 # Extract clean JSON from response
 raw_text = message.content[0].text
 clean_text = raw_text.strip().strip("```").replace("json\n", "")
-data = json.loads(clean_text)
+data = orjson.loads(clean_text)
 
 #print(data)
 
@@ -106,7 +106,7 @@ os.makedirs(output_dir, exist_ok=True)
 
 output_path = os.path.join(output_dir, "eval_data_50.json")
 
-with open(output_path, "w", encoding="utf-8") as f:
-    json.dump(data, f, ensure_ascii=False, indent=4)
+with open(output_path, "wb") as f:
+    f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
 
 print(f"\nSaved evaluation dataset to: {output_path}")
\ No newline at end of file
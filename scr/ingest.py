@@ -0,0 +1,421 @@
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+from langchain_chroma import Chroma
+from langchain_openai import OpenAIEmbeddings
+from openai import AsyncOpenAI
+import getpass
+import hashlib
+import httpx
+import numpy as np
+import os
+import shutil
+import tempfile
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from pathlib import Path
+from typing import List, Tuple
+import asyncio
+import re
+import tiktoken
+
+
+# Paths
+main_path = "../data/final/main.md"
+chroma_path = "../chroma"
+build_hash_file = ".build_hash"
+# Local caches live outside chroma/, which is cleared on every rebuild
+cache_dir = "../cache"
+chunk_embeddings_path = os.path.join(cache_dir, "chunk_embeddings.npz")
+
+# Embeddings
+EMBEDDING_MODEL = "text-embedding-ada-002"
+EMBEDDING_BATCH_SIZE = 512
+EMBEDDING_MAX_BATCH_TOKENS = 290_000  # below the API's 300k tokens per request
+EMBEDDING_CONCURRENCY = 8
+EMBEDDING_MAX_RETRIES = 6
+
+# Chunking (the splitter is stateless, so one instance is shared by all sections)
+CHUNK_SIZE = 2000
+CHUNK_OVERLAP = 200
+TEXT_SPLITTER = RecursiveCharacterTextSplitter(
+    chunk_size=CHUNK_SIZE,
+    chunk_overlap=CHUNK_OVERLAP,
+)
+HEADER_PREFIX = "{header_path}\n\n"
+
+# Regex
+HEADER_REGEX = re.compile(r"^[^\S\n]*(#{1,4})(?=$| )(.*)$", re.MULTILINE)
+CODE_FENCE_REGEX = re.compile(r"^[^\S\n]*(?:```|~~~).*$", re.MULTILINE)
+BLANK_LINES_REGEX = re.compile(r"\n{2,}")
+
+# === Load corpus ===
+
+def load_corpus(main_path: str) -> str:
+    """Load main.md as corpus."""
+    return Path(main_path).read_text(encoding="utf-8")
+
+# == Extract front matter (front page) - not embedding-friendly ==    
+
+def extract_front_matter(corpus_text: str) -> str:
+    match = re.search(r"---\s*(.*?)\s*## Abstract", corpus_text, re.DOTALL)
+    return match.group(1) if match else ""
+
+
+# === Split by Markdown structure ===
+
+def build_header_path(metadata):
+    """Build header path from metadata: create 'Header1 > Header2 > Header3' string."""
+    levels = ["Header 1", "Header 2", "Header 3", "Header 4"]
+    headers = [metadata[level] for level in levels if metadata.get(level)]
+    return "Headers: " + " > ".join(headers)
+
+def clean_section(text: str) -> str:
+    """
+    Normalize a section the way MarkdownHeaderTextSplitter does: strip each line,
+    drop non-printable characters, and join paragraphs with '  \\n'.
+    """
+    text = "\n".join(line.strip() for line in text.strip().split("\n"))
+    if not text.replace("\n", "").isprintable():
+        text = text.translate({ord(ch): None for ch in set(text) if ch != "\n" and not ch.isprintable()})
+    return "  \n".join(p for p in BLANK_LINES_REGEX.split(text) if p)
+
+def find_code_fences(corpus_text: str) -> List[Tuple[int, int]]:
+    """
+    Return (start, end) spans of fenced code blocks, opened and closed the way
+    MarkdownHeaderTextSplitter does: a ``` line opens a block only if it holds a single ```,
+    the block closes on the first line starting with the same fence, and an unclosed
+    fence runs to the end of the text.
+    """
+    fences = []
+    opening, opening_start = None, 0
+    for match in CODE_FENCE_REGEX.finditer(corpus_text):
+        line = match.group().strip()
+        if opening is None:
+            if line.startswith("```") and line.count("```") == 1:
+                opening, opening_start = "```", match.start()
+            elif line.startswith("~~~"):
+                opening, opening_start = "~~~", match.start()
+        elif line.startswith(opening):
+            fences.append((opening_start, match.end()))
+            opening = None
+    if opening is not None:
+        # +1 so the (empty) line after a trailing newline still counts as fenced
+        fences.append((opening_start, len(corpus_text) + 1))
+    return fences
+
+def clean_fenced_section(text: str, offset: int, fences: List[Tuple[int, int]]) -> str:
+    """
+    Like clean_section, but lines inside a code fence (text starts at corpus offset `offset`)
+    are kept as they are, blank lines included, as MarkdownHeaderTextSplitter does.
+    """
+    paragraphs = []
+    current = []
+    pos = offset
+    for line in text.split("\n"):
+        in_fence = any(a <= pos < b for a, b in fences)
+        pos += len(line) + 1
+        line = "".join(filter(str.isprintable, line.strip()))
+        if in_fence or line:
+            current.append(line)
+        elif current:
+            paragraphs.append("\n".join(current))
+            current = []
+    if current:
+        paragraphs.append("\n".join(current))
+    return "  \n".join(paragraphs)
+
+def split_markdown(corpus_text: str) -> List[Tuple[str, str]]:
+    """
+    Split corpus text by Markdown headers (#, ##, ###, ####) in a single regex pass,
+    preserving tables, lists, code blocks (headers inside fenced code are ignored).
+    Returns a list of (header_path, section_text) pairs.
+    """
+    fences = find_code_fences(corpus_text)
+
+    sections = []
+    headers = {}
+
+    def add_section(start, end):
+        text = corpus_text[start:end]
+        if any(a < end and b > start for a, b in fences):
+            content = clean_fenced_section(text, start, fences)
+        else:
+            content = clean_section(text)
+        if not content:
+            return
+        # Consecutive sections under identical headers are merged
+        if sections and sections[-1][0] == headers:
+            sections[-1][1] += "  \n" + content
+        else:
+            sections.append([dict(headers), content])
+
+    start = 0
+    for match in HEADER_REGEX.finditer(corpus_text):
+        if any(a <= match.start() < b for a, b in fences):
+            continue
+
+        add_section(start, match.start())
+        start = match.end()
+
+        # A header closes all headers of the same or deeper level
+        level = len(match.group(1))
+        for deeper in range(level, 5):
+            headers.pop(f"Header {deeper}", None)
+        headers[f"Header {level}"] = clean_section(match.group(2))
+
+    add_section(start, len(corpus_text))
+
+    return [(build_header_path(metadata), text) for metadata, text in sections]
+
+# === Recursive chunking with metadata (headers) ===
+
+def chunk_section(header_path: str, text: str) -> List[Document]:
+    """Split one section into chunks, each prefixed with its header path."""
+    # Prefix the header path once, so the chunk's section is part of its embedding
+    header_prefix = HEADER_PREFIX.format(header_path=header_path)
+
+    # Metadata is built once per section (Document copies it per chunk)
+    metadata = {"header_path": header_path}
+
+    return [
+        Document(page_content=header_prefix + chunk, metadata=metadata)
+        for chunk in TEXT_SPLITTER.split_text(text)
+    ]
+
+def chunk_documents(sections: List[Tuple[str, str]]) -> List[Document]:
+    """
+    Split (header_path, section_text) pairs into smaller chunks recursively.
+    """
+    return list(chain.from_iterable(chunk_section(header_path, text) for header_path, text in sections))
+
+
+# === Create Chroma vectorstore ===
+
+def make_embedding_function(http_client: httpx.Client = None) -> OpenAIEmbeddings:
+    """
+    Embeddings used by Chroma (and the query side), batching up to EMBEDDING_BATCH_SIZE texts per request.
+    Pass http_client to share one connection pool with the other OpenAI clients.
+    """
+    return OpenAIEmbeddings(
+        model=EMBEDDING_MODEL,
+        chunk_size=EMBEDDING_BATCH_SIZE,
+        max_retries=EMBEDDING_MAX_RETRIES,
+        http_client=http_client,
+    )
+
+def batch_tokens(token_lists: List[List[int]]) -> List[List[List[int]]]:
+    """
+    Group tokenized texts into request batches of at most EMBEDDING_BATCH_SIZE inputs
+    and EMBEDDING_MAX_BATCH_TOKENS tokens.
+    """
+    batches = []
+    batch = []
+    batch_size_tokens = 0
+    for tokens in token_lists:
+        if batch and (len(batch) == EMBEDDING_BATCH_SIZE or batch_size_tokens + len(tokens) > EMBEDDING_MAX_BATCH_TOKENS):
+            batches.append(batch)
+            batch = []
+            batch_size_tokens = 0
+        batch.append(tokens)
+        batch_size_tokens += len(tokens)
+    if batch:
+        batches.append(batch)
+
+    return batches
+
+async def embed_batches(batches: List[List[List[int]]]) -> List[List[float]]:
+    """Embed batches of token arrays concurrently (at most EMBEDDING_CONCURRENCY requests in flight), keeping input order."""
+    async with AsyncOpenAI(max_retries=EMBEDDING_MAX_RETRIES) as async_client:
+        semaphore = asyncio.Semaphore(EMBEDDING_CONCURRENCY)
+
+        async def embed_batch(batch):
+            async with semaphore:
+                response = await async_client.embeddings.create(
+                    model=EMBEDDING_MODEL,
+                    input=batch
+                )
+            return [item.embedding for item in response.data]
+
+        results = await asyncio.gather(*(embed_batch(batch) for batch in batches))
+
+    return [vector for batch_vectors in results for vector in batch_vectors]
+
+def run_coroutine(coro):
+    """
+    asyncio.run, also from code that already has an event loop running (e.g. a notebook
+    calling get_rag_answer): there the coroutine gets its own loop on a worker thread.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(1) as executor:
+        return executor.submit(asyncio.run, coro).result()
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def embed_texts(texts: List[str], known: dict = None) -> List[List[float]]:
+    """
+    Embed texts with the OpenAI embeddings endpoint. Texts whose hash is in known
+    (text hash -> vector) are not sent again; the others are tokenized once with
+    tiktoken and sent as token arrays, in token-bounded batches (see batch_tokens)
+    with several requests in flight.
+    """
+    known = dict(known or {})
+    hashes = [text_hash(text) for text in texts]
+    missing = list(dict.fromkeys(text for text, h in zip(texts, hashes) if h not in known))
+
+    if missing:
+        encoding = tiktoken.encoding_for_model(EMBEDDING_MODEL)
+        token_lists = encoding.encode_ordinary_batch(missing)
+        vectors = run_coroutine(embed_batches(batch_tokens(token_lists)))
+        known.update(zip(map(text_hash, missing), vectors))
+
+    return [known[h] for h in hashes]
+
+def load_chunk_embeddings(path: str = chunk_embeddings_path) -> dict:
+    """Return text hash -> vector from the previous build (same embedding model only), or {}."""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with np.load(path) as data:
+            if str(data["model"]) != EMBEDDING_MODEL:
+                return {}
+            return dict(zip(data["hashes"].tolist(), data["vectors"].tolist()))
+    except Exception:
+        # Best-effort cache: an unreadable file (e.g. truncated by an interrupted build) means re-embed
+        return {}
+
+def save_chunk_embeddings(texts: List[str], vectors: List[List[float]], path: str = chunk_embeddings_path):
+    """Write the vectors to a temporary file next to path and swap it in, so an interrupted save never leaves a broken cache."""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez(
+                f,
+                model=np.array(EMBEDDING_MODEL),
+                hashes=np.array([text_hash(text) for text in texts]),
+                vectors=np.asarray(vectors, dtype=np.float32),
+            )
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def create_vectorstore(chunks: List[Document], embedding_function: OpenAIEmbeddings, persist_dir: str = chroma_path) -> Chroma:
+    """
+    Create a Chroma vectorstore from chunked documents using OpenAI embeddings.
+    All chunks are embedded up front and written in a single collection.add call;
+    chunks whose text is unchanged since the previous build reuse its vectors.
+    If the persist_dir exists, it is cleared first, but only once the new vectors
+    exist, so a failed embedding run leaves the previous index in place.
+    """
+    texts = [chunk.page_content for chunk in chunks]
+    embeddings = embed_texts(texts, load_chunk_embeddings())
+
+    if os.path.exists(persist_dir):
+        shutil.rmtree(persist_dir)
+
+    db = Chroma(
+        persist_directory=persist_dir,
+        embedding_function=embedding_function
+    )
+    db._collection.add(
+        ids=[str(uuid.uuid4()) for _ in chunks],
+        documents=texts,
+        metadatas=[chunk.metadata for chunk in chunks],
+        embeddings=embeddings,
+    )
+    save_chunk_embeddings(texts, embeddings)
+    #print(f"Saved {len(chunks)} chunks to {persist_dir}.")
+    return db
+
+
+# === Build the index only when the corpus changes ===
+
+def compute_build_hash(corpus_path: str = main_path) -> str:
+    """
+    Fingerprint of everything the index is built from (corpus contents, chunking, embedding model).
+    The bibliography is not embedded, so editing biblio.bib does not trigger a rebuild.
+    """
+    with open(corpus_path, "rb") as f:
+        hasher = hashlib.sha256(f.read())
+    hasher.update(repr((CHUNK_SIZE, CHUNK_OVERLAP, HEADER_PREFIX)).encode("utf-8"))
+    hasher.update(EMBEDDING_MODEL.encode("utf-8"))
+    return hasher.hexdigest()
+
+def read_build_hash(persist_dir: str = chroma_path) -> str:
+    """Return the hash stored with the persisted index, or '' if there is none."""
+    path = os.path.join(persist_dir, build_hash_file)
+    if not os.path.exists(path):
+        return ""
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read().strip()
+
+def build_index(corpus_text: str, embedding_function: OpenAIEmbeddings, persist_dir: str = chroma_path) -> Chroma:
+    """Split, chunk and embed the corpus into a fresh Chroma vectorstore."""
+    # Load front matter
+    front_matter = extract_front_matter(corpus_text)
+    #print(front_matter)
+
+    front_section = (
+        "Front Matter > Title Page",
+        "This is the title page and metadata of the thesis.\n" + front_matter
+    )
+
+    # Split by Markdown
+    sections = split_markdown(corpus_text)
+    sections.insert(0, front_section)
+    #print(f"Structured blocks: {len(sections)}")
+
+    # Chunking
+    chunks = chunk_documents(sections)
+    #print(f"Final chunks: {len(chunks)}")
+
+    # Inspect chunks
+    #for i, doc in enumerate(chunks[:5], start=1):
+    #    print(f"\n--- Chunk {i} ---")
+    #    print(doc.page_content)
+
+    # Create vectorstore
+    return create_vectorstore(chunks, embedding_function, persist_dir)
+
+def write_build_hash(build_hash: str, persist_dir: str = chroma_path):
+    with open(os.path.join(persist_dir, build_hash_file), "w", encoding="utf-8") as f:
+        f.write(build_hash)
+
+def ensure_index(embedding_function: OpenAIEmbeddings, persist_dir: str = chroma_path, force: bool = False) -> Chroma:
+    """
+    Open the persisted Chroma index. The corpus is only loaded, split, chunked
+    and embedded if the index is missing or was built from different sources
+    (or always, with force=True).
+    """
+    build_hash = compute_build_hash()
+
+    if force or read_build_hash(persist_dir) != build_hash:
+        build_index(load_corpus(main_path), embedding_function, persist_dir)
+        write_build_hash(build_hash, persist_dir)
+
+    return Chroma(persist_directory=persist_dir, embedding_function=embedding_function)
+
+
+# === Insert OpenAI API key if needed ===
+
+def set_openai_api_key():
+    """Prompt for OpenAI API key if not already in environment variables."""
+    if not os.environ.get("OPENAI_API_KEY"):
+        os.environ["OPENAI_API_KEY"] = getpass.getpass("Enter API key for OpenAI: ")
+
+
+# === CLI: rebuild the index ===
+
+if __name__ == "__main__":
+    set_openai_api_key()
+
+    # Always rebuild, even if the stored hash still matches
+    ensure_index(make_embedding_function(), force=True)
+    #print("Index rebuilt.")
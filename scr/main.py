@@ -1,141 +1,51 @@
-from langchain_text_splitters import RecursiveCharacterTextSplitter, MarkdownHeaderTextSplitter
-from langchain_core.documents import Document
-from langchain_chroma import Chroma
-from langchain_openai import OpenAIEmbeddings
+from langchain_core.embeddings import Embeddings
 from openai import OpenAI
 from pybtex.database import parse_file
 from pybtex.style.formatting import plain
 from pybtex.plugin import find_plugin
-import getpass
-import os
-import shutil
-from typing import List
+from pybtex.utils import OrderedCaseInsensitiveDict
+from contextlib import closing
+from typing import List, Tuple
 import argparse
+import functools
+import hashlib
+import httpx
+import numpy as np
+import orjson
+import os
+import pickle
 import re
+import sqlite3
+import threading
+
+from ingest import cache_dir, chroma_path, ensure_index, make_embedding_function, set_openai_api_key
 
 
 # Paths
-main_path = "../data/final/main.md"
 bib_path = "../data/final/biblio.bib"
-chroma_path = "../chroma"
-
-# Regex
-CITATION_BLOCK_REGEX = re.compile(r"\[@([^\]]+)\]")
-CITATION_KEY_REGEX = re.compile(r"@([^\s;,\]]+)")
-
-# === Load corpus ===
-
-def load_corpus(main_path: str) -> str:
-    """Load main.md as corpus."""
-    with open(main_path, "r", encoding="utf-8") as f:
-        return f.read()
-
-# == Extract front matter (front page) - not embedding-friendly ==    
-
-def extract_front_matter(corpus_text: str) -> str:
-    match = re.search(r"---\s*(.*?)\s*## Abstract", corpus_text, re.DOTALL)
-    return match.group(1) if match else ""
-
-
-# === Split by Markdown structure ===
-
-def build_header_path(metadata):
-    """Build header path from metadata: create 'Header1 > Header2 > Header3' string."""
-    levels = ["Header 1", "Header 2", "Header 3", "Header 4"]
-    headers = [metadata[level] for level in levels if metadata.get(level)]
-    return "Headers: " + " > ".join(headers)
-
-def split_markdown(corpus_text: str) -> List[Document]:
-    """
-    Split corpus text by Markdown headers, preserving tables, lists, code blocks.
-    Returns a list of Documents.
-    """
-    markdown_splitter = MarkdownHeaderTextSplitter(
-        headers_to_split_on=[
-            ("#", "Header 1"),
-            ("##", "Header 2"),
-            ("###", "Header 3"),
-            ("####", "Header 4"),
-        ]
-    )
-
-    sections = markdown_splitter.split_text(corpus_text)
-
-    structured_docs = []
-
-    for sec in sections:
-        header_path = build_header_path(sec.metadata)
-
-        structured_docs.append(
-            Document(
-                page_content=sec.page_content,
-                metadata={"header_path": header_path}
-            )
-        )
-
-    return structured_docs
-
-# === Recursive chunking with metadata (headers) ===
-
-def chunk_documents(structured_docs: List[Document], chunk_size: int = 2000, chunk_overlap: int = 200) -> List[Document]:
-    """
-    Split structured Documents into smaller chunks recursively.
-    """
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size,
-        chunk_overlap=chunk_overlap,
-        add_start_index=True,
-    )
-
-    all_chunks = []
+query_cache_path = os.path.join(cache_dir, "query_embed_cache.sqlite")
+bib_cache_path = os.path.join(cache_dir, "bib_cache.pkl")
 
-    for doc in structured_docs:
-        chunks = text_splitter.create_documents([doc.page_content])
 
-        header_path = doc.metadata["header_path"]
-
-        # Repeat header path twice to boost embedding importance
-        header_boost = f"{header_path}\n{header_path}\n\n"
-
-        for chunk in chunks:
-            # Add header path to metadata
-            chunk.metadata["header_path"] = header_path
-
-            # Prepend boosted header path
-            chunk.page_content = f"{header_boost}{chunk.page_content}"
-
-            all_chunks.append(chunk)
-
-    return all_chunks
-
-
-# === Create Chroma vectorstore ===
-
-def create_vectorstore(chunks: List[Document], persist_dir: str = chroma_path) -> Chroma:
-    """
-    Create a Chroma vectorstore from chunked documents using OpenAI embeddings.
-    If the persist_dir exists, it is cleared first.
-    """
-    if os.path.exists(persist_dir):
-        shutil.rmtree(persist_dir)
-
-    db = Chroma.from_documents(
-        chunks,
-        OpenAIEmbeddings(),
-        persist_directory=persist_dir
-    )
-    #print(f"Saved {len(chunks)} chunks to {persist_dir}.")
-    return db
+# Regex
+CITATION_BLOCK_REGEX = re.compile(r"\[(@[^\]]+)\]")
+CITATION_KEY_REGEX = re.compile(r"(?<![^\s;,])@([^\s;,]+)")
+KEY_SPLIT_REGEX = re.compile(r"[;,\s]+")
+AUTHOR_YEAR_REGEX = re.compile(r"\(([^,]+),\s*([0-9]{4}|n\.d\.)\)")
 
 
 # === Extract citation keys ===
 
 def extract_citation_keys(text: str) -> List[str]:
+    """
+    Return the unique citation keys used in [@key; @key2] blocks, in order of first use.
+    Only the blocks replace_citations_with_author_year resolves count:
+    "[@a; @b] and @c]" -> ['a', 'b'], "[see @x]" -> [], "email foo @bar]" -> [].
+    """
     keys = []
-    for block in CITATION_BLOCK_REGEX.findall(text):
-        found = CITATION_KEY_REGEX.findall(block)
-        keys.extend(found)
-    return list(set(keys))
+    for block in CITATION_BLOCK_REGEX.finditer(text):
+        keys.extend(CITATION_KEY_REGEX.findall(block.group(1)))
+    return list(dict.fromkeys(keys))
 
 
 # === Bibliography ===
@@ -144,24 +54,94 @@ class PybtexFormatter:
     """
     Format citations from a .bib file in plain style (authors. title. publisher, year.)
     """
-    def __init__(self, bib_path: str):
-        self.bib_data = parse_file(bib_path)
+    def __init__(self, bib_path: str, cache_path: str = None):
         self.formatter = plain.Style()
         self.backend = find_plugin('pybtex.backends', 'text')()
 
-    def format_entry(self, key: str) -> str:
-        if key not in self.bib_data.entries:
-            return f"[Reference not found for key: {key}]"
-        entry = self.bib_data.entries[key]
+        # Parsed entries and lookup tables are pickled, keyed by the hash of the .bib file
+        with open(bib_path, "rb") as f:
+            bib_hash = hashlib.sha256(f.read()).hexdigest()
+
+        tables = self.load_cache(cache_path, bib_hash) if cache_path else None
+        if tables:
+            self.bib_data, self.first_author_index, self.rendered, self.author_year = tables
+            return
+
+        self.bib_data = parse_file(bib_path)
+        self.build_tables()
+
+        if cache_path:
+            self.save_cache(cache_path, bib_hash)
+
+    def build_tables(self):
+        # (first author's last name, year) -> keys, for matching (Author, Year) citations
+        self.first_author_index = {}
+        for key, entry in self.bib_data.entries.items():
+            persons = entry.persons.get("author", [])
+            if not persons or not persons[0].last_names:
+                continue
+            lastname = persons[0].last_names[0].lower()
+            year = entry.fields.get("year", "n.d.")
+            self.first_author_index.setdefault((lastname, year), []).append(key)
+
+        # key -> rendered reference and key -> "(Author, Year)", computed once for the
+        # whole bibliography (case-insensitive, like pybtex's own entry keys)
+        self.rendered = OrderedCaseInsensitiveDict()
+        self.author_year = OrderedCaseInsensitiveDict()
+        for key, entry in self.bib_data.entries.items():
+            self.rendered[key] = self.render_entry(entry)
+            self.author_year[key] = self.format_author_year(entry)
+
+    @staticmethod
+    def load_cache(cache_path: str, bib_hash: str):
+        """Return the cached (bib_data, first_author_index, rendered, author_year), or None if stale or unreadable."""
+        if not os.path.exists(cache_path):
+            return None
+        try:
+            with open(cache_path, "rb") as f:
+                cached_hash, tables = pickle.load(f)
+        except Exception:
+            # Best-effort cache: any failure to unpickle (truncated file, pybtex upgrade, ...) means rebuild
+            return None
+        return tables if cached_hash == bib_hash else None
+
+    def save_cache(self, cache_path: str, bib_hash: str):
+        tables = (self.bib_data, self.first_author_index, self.rendered, self.author_year)
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(cache_path, "wb") as f:
+            pickle.dump((bib_hash, tables), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def format_author_year(entry) -> str:
+        # Extract authors
+        persons = entry.persons.get("author", [])
+        lastnames = [p.last_names[0] for p in persons] if persons else []
+
+        # Format author string
+        if len(lastnames) == 0:
+            author_str = "Unknown"
+        elif len(lastnames) == 1:
+            author_str = lastnames[0]
+        elif len(lastnames) == 2:
+            author_str = f"{lastnames[0]} and {lastnames[1]}"
+        else:
+            author_str = f"{lastnames[0]} et al."
+
+        # Extract year
+        year = entry.fields.get("year", "n.d.")
+
+        return f"({author_str}, {year})"
+
+    def render_entry(self, entry) -> str:
         formatted = self.formatter.format_entries([entry])
         for fe in formatted:
             return fe.text.render(self.backend)
 
+    def format_entry(self, key: str) -> str:
+        return self.rendered.get(key, f"[Reference not found for key: {key}]")
+
     def format_all(self):
-        citations = []
-        for key in self.bib_data.entries:
-            citations.append(self.format_entry(key))
-        return citations
+        return list(self.rendered.values())
     
 
 def get_author_year(formatter: PybtexFormatter, key: str):
@@ -184,7 +164,7 @@ def replace_citations_with_author_year(answer_text: str, formatter: PybtexFormat
         inside = match.group(1)
 
         # Split by semicolon, comma, or whitespace
-        raw_parts = re.split(r'[;,\s]+', inside)
+        raw_parts = KEY_SPLIT_REGEX.split(inside)
 
         keys = []
         for part in raw_parts:
@@ -194,32 +174,8 @@ def replace_citations_with_author_year(answer_text: str, formatter: PybtexFormat
             if key:
                 keys.append(key)
 
-        citations = []
-
-        for key in keys:
-            entry = formatter.bib_data.entries.get(key)
-            if entry is None:
-                citations.append("")
-                continue
-
-            # Extract authors
-            persons = entry.persons.get("author", [])
-            lastnames = [p.last_names[0] for p in persons] if persons else []
-
-            # Format author string
-            if len(lastnames) == 0:
-                author_str = "Unknown"
-            elif len(lastnames) == 1:
-                author_str = lastnames[0]
-            elif len(lastnames) == 2:
-                author_str = f"{lastnames[0]} and {lastnames[1]}"
-            else:
-                author_str = f"{lastnames[0]} et al."
-
-            # Extract year
-            year = entry.fields.get("year", "n.d.")
-
-            citations.append(f"({author_str}, {year})")
+        # Unknown keys are dropped (replaced by an empty string)
+        citations = [formatter.author_year.get(key, "") for key in keys]
 
         if not citations:
             return match.group(0)
@@ -240,8 +196,7 @@ def extract_used_sources(answer_text: str, formatter: PybtexFormatter) -> List[s
     """
 
     # Match citations
-    citation_pattern = re.compile(r"\(([^,]+),\s*([0-9]{4}|n\.d\.)\)")
-    matches = citation_pattern.findall(answer_text)
+    matches = AUTHOR_YEAR_REGEX.findall(answer_text)
 
     used_keys = set()
 
@@ -254,96 +209,152 @@ def extract_used_sources(answer_text: str, formatter: PybtexFormatter) -> List[s
         first_author = author_block.split("and")[0].split("et al.")[0].strip()
         first_author = first_author.lower()
 
-        # Search BibTeX for matching entry
-        for key, entry in formatter.bib_data.entries.items():
-            persons = entry.persons.get("author", [])
-            if not persons:
-                continue
+        # Look up BibTeX entries with the same first author and year
+        used_keys.update(formatter.first_author_index.get((first_author, year), ()))
 
-            # First author's last name from .bib
-            bib_lastname = persons[0].last_names[0].lower()
-            bib_year = entry.fields.get("year", "n.d.")
+    return [formatter.format_entry(key) for key in used_keys]
 
-            if bib_lastname == first_author and bib_year == year:
-                used_keys.add(key)
 
-    return [formatter.format_entry(key) for key in used_keys]
+# === Query embedding cache ===
 
+class CachedQueryEmbeddings(Embeddings):
+    """
+    Cache query embeddings by exact text: an in-process LRU in front of a small
+    SQLite table, so repeated questions skip the OpenAI round-trip, also across runs.
+    Documents are passed straight through to the wrapped embeddings.
+    """
+    def __init__(self, inner: Embeddings, path: str = query_cache_path, maxsize: int = 1024):
+        self.inner = inner
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.model = getattr(inner, "model", "")
+        self.cached_query = functools.lru_cache(maxsize=maxsize)(self.lookup)
+
+    def connect(self) -> sqlite3.Connection:
+        # A connection per call, since questions are answered from several threads (evaluation.py)
+        conn = sqlite3.connect(self.path)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS query_embeddings "
+            "(model TEXT, text TEXT, vector BLOB, PRIMARY KEY (model, text))"
+        )
+        return conn
+
+    def lookup(self, text: str) -> List[float]:
+        with closing(self.connect()) as conn:
+            row = conn.execute(
+                "SELECT vector FROM query_embeddings WHERE model = ? AND text = ?",
+                (self.model, text)
+            ).fetchone()
+        if row:
+            return orjson.loads(row[0])
+
+        vector = self.inner.embed_query(text)
+        with closing(self.connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO query_embeddings VALUES (?, ?, ?)",
+                (self.model, text, orjson.dumps(vector))
+            )
+        return vector
 
-# === Insert OpenAI API key if needed ===
+    def embed_query(self, text: str) -> List[float]:
+        return self.cached_query(text)
 
-def set_openai_api_key():
-    """Prompt for OpenAI API key if not already in environment variables."""
-    if not os.environ.get("OPENAI_API_KEY"):
-        os.environ["OPENAI_API_KEY"] = getpass.getpass("Enter API key for OpenAI: ")
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.inner.embed_documents(texts)
 
 
-# === Global initialization ===
+# === Exact in-memory search ===
 
-set_openai_api_key()
+class FlatIndex:
+    """
+    Exact nearest-neighbour search over the vectors stored in Chroma, loaded once.
+    The thesis gives a few hundred chunks, so one matrix-vector product is faster
+    than a Chroma query; distances are squared L2 like Chroma's "l2" space and go
+    through the same relevance score function, so the 0.5 threshold is unchanged.
+
+    Vectors are kept as int8 codes with one scale per vector (4x less memory to scan);
+    squared norms are computed before quantizing, so only the dot product is
+    approximate (relevance scores move by about 1e-3).
+    """
+    def __init__(self, db):
+        data = db._collection.get(include=["embeddings", "documents"])
+        self.documents = data["documents"]
+        vectors = np.asarray(data["embeddings"], dtype=np.float32)
+        self.squared_norms = np.einsum("ij,ij->i", vectors, vectors)
+        self.scales = np.abs(vectors).max(axis=1) / 127
+        self.codes = np.round(vectors / self.scales[:, None]).astype(np.int8)
+        self.relevance_score_fn = db._select_relevance_score_fn()
 
-# Load corpus
-corpus_text = load_corpus(main_path)
-#print("Corpus loaded.")
+    def search(self, query_vector: List[float], k: int = 4) -> List[Tuple[str, float]]:
+        """Return the k closest documents with their relevance scores, best first."""
+        k = min(k, len(self.documents))
+        if k == 0:
+            return []
 
-# Load front matter
-front_matter = extract_front_matter(corpus_text)
-#print(front_matter)
+        query = np.asarray(query_vector, dtype=np.float32)
+        distances = self.squared_norms - 2 * self.scales * (self.codes @ query) + query @ query
 
-front_doc = Document(
-    page_content=(
-        "This is the title page and metadata of the thesis.\n"
-        + front_matter
-    ),
-    metadata={"header_path": "Front Matter > Title Page"}
-)
+        top = np.argpartition(distances, k - 1)[:k]
+        top = top[np.argsort(distances[top])]
+        return [(self.documents[i], self.relevance_score_fn(float(distances[i]))) for i in top]
 
-# Load bibliography
-formatter = PybtexFormatter(bib_path)
-#print(formatter.bib_data.entries.keys())
 
-# Split by Markdown
-structured_docs = split_markdown(corpus_text)
-structured_docs.insert(0, front_doc)
-#print(f"Structured blocks: {len(structured_docs)}")
+# === Connection warm-up ===
+
+def preconnect(http_client: httpx.Client, url: str):
+    """Establish (and pool) the TLS connection to the API, so the first real call skips the handshake."""
+    try:
+        http_client.head(url)
+    except httpx.HTTPError:
+        pass
+
+
+# === Global initialization ===
+
+set_openai_api_key()
 
-# Chunking
-chunks = chunk_documents(structured_docs)
-#print(f"Final chunks: {len(chunks)}")
+# OpenAI clients, created once and sharing one HTTP/2 connection pool, so the
+# chat and embedding calls reuse the same kept-alive TLS connection
+http_client = httpx.Client(http2=True, limits=httpx.Limits(max_keepalive_connections=10))
+client = OpenAI(http_client=http_client, timeout=60, max_retries=4)
+embedding_function = CachedQueryEmbeddings(make_embedding_function(http_client))
 
-# Create vectorstore
-db = create_vectorstore(chunks)
+# Open the API connection in the background while the index and bibliography load
+threading.Thread(target=preconnect, args=(http_client, str(client.base_url)), daemon=True).start()
 
-# Inspect chunks
-#for i, doc in enumerate(chunks[:5], start=1):
-#    print(f"\n--- Chunk {i} ---")
-#    print(doc.page_content)
+# Load bibliography
+formatter = PybtexFormatter(bib_path, bib_cache_path)
+#print(formatter.bib_data.entries.keys())
 
-# Prepare the DB
-embedding_function = OpenAIEmbeddings()
-db = Chroma(persist_directory=chroma_path, embedding_function=embedding_function)
+# The DB is opened on first retrieval, so `main.py ingest` never loads it for search
+flat_index = None
+flat_index_lock = threading.Lock()
+
+def get_flat_index() -> FlatIndex:
+    """Open the DB once (ingest runs only when main.md has changed); safe to call from several threads."""
+    global flat_index
+    with flat_index_lock:
+        if flat_index is None:
+            flat_index = FlatIndex(ensure_index(embedding_function))
+    return flat_index
 
 # == RAG function ==
 
-def get_rag_answer(question: str):
-    
+LLM_MODEL = "gpt-4o-mini"
+NO_CONTEXT_ANSWER = "Unable to find relevant context in the thesis"
+
+def retrieve_context(question: str) -> List[str]:
+    """Return the retrieved chunks for the question, or [] if none is relevant enough."""
     # Search the DB
-    results = db.similarity_search_with_relevance_scores(question, k=4)
+    results = get_flat_index().search(embedding_function.embed_query(question), k=4)
 
     if not results or results[0][1] < 0.5:
-        return "Unable to find relevant context in the thesis", []
-    
-    docs = [doc for doc, _score in results]
-    
-    context_text = "\n---\n".join(doc.page_content for doc in docs)
-
-    context_for_eval = list(doc.page_content for doc in docs)
+        return []
 
-    # Citation keys from retrieved context
-    #found_keys = extract_citation_keys(context_text)
+    return [text for text, _score in results]
 
-    # Prompt
-    PROMPT = f"""
+def build_prompt(context_text: str, question: str) -> str:
+    return f"""
     You are answering a question based strictly on the provided CONTEXT, which comes from a master's thesis.
     The CONTEXT may contain chapter or section headers; these headers are metadata only and must NOT be mentioned, paraphrased, or used as sources in your answer.
 
@@ -365,11 +376,19 @@ def get_rag_answer(question: str):
     Provide a clear answer:
     """
 
+def get_rag_answer(question: str):
+
+    context_for_eval = retrieve_context(question)
+
+    if not context_for_eval:
+        return NO_CONTEXT_ANSWER, "", []
+
+    context_text = "\n---\n".join(context_for_eval)
+
     # Call the LLM
-    client = OpenAI()
     response = client.responses.create(
-        model="gpt-4o-mini",
-        input=PROMPT
+        model=LLM_MODEL,
+        input=build_prompt(context_text, question)
     )
     raw_answer = response.output_text.strip()
 
@@ -380,15 +399,33 @@ def get_rag_answer(question: str):
     answer = replace_citations_with_author_year(raw_answer, formatter)
     return answer, context_text, context_for_eval
 
+def get_rag_answer_stream(question: str):
+    """
+    Stream the raw answer (citation tags not yet replaced) as text deltas.
+    The caller joins the deltas and runs replace_citations_with_author_year on the result.
+    """
+    context_for_eval = retrieve_context(question)
 
-# === CLI ===
+    if not context_for_eval:
+        yield NO_CONTEXT_ANSWER
+        return
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
-    parser.add_argument("question", type=str, help="Question for the RAG system")
-    args = parser.parse_args()
+    context_text = "\n---\n".join(context_for_eval)
 
-    answer, context, context_for_eval = get_rag_answer(args.question)
+    # Call the LLM
+    with client.responses.stream(
+        model=LLM_MODEL,
+        input=build_prompt(context_text, question)
+    ) as stream:
+        for event in stream:
+            if event.type == "response.output_text.delta":
+                yield event.delta
+
+
+# === CLI ===
+
+def ask(question: str):
+    answer, context, context_for_eval = get_rag_answer(question)
 
     # Print the context
     #print("\nContext:\n")
@@ -406,3 +443,21 @@ if __name__ == "__main__":
         for s in sources:
             print(f"{s}")
             print()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ingest_parser = subparsers.add_parser("ingest", help="Build the vectorstore (only if main.md has changed)")
+    ingest_parser.add_argument("--force", action="store_true", help="Rebuild even if the index is up to date")
+
+    ask_parser = subparsers.add_parser("ask", help="Answer a question about the thesis")
+    ask_parser.add_argument("question", type=str, help="Question for the RAG system")
+
+    args = parser.parse_args()
+
+    if args.command == "ingest":
+        ensure_index(embedding_function, force=args.force)
+        print(f"Vectorstore ready in {chroma_path}")
+    else:
+        ask(args.question)
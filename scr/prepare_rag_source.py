@@ -1,3 +1,4 @@
+import mmap
 import re
 import subprocess
 import os
@@ -48,46 +49,59 @@ TIPA_MAP = {
 
 VOWELS = "aeɛoɔuɨyãẽõɛ̃ɔ̃"
 
+
+def alternation_pattern(mapping):
+    """Pattern matching any key of mapping, longest keys first (same precedence as replacing them in that order)."""
+    return "|".join(re.escape(key) for key in sorted(mapping, key=len, reverse=True))
+
+EXTERNAL_MACROS_PATTERN = alternation_pattern(EXTERNAL_MACROS)
+EXTERNAL_MACROS_REGEX = re.compile(EXTERNAL_MACROS_PATTERN)
+# Multi-character TIPA sequences go through a regex, single characters through str.translate
+TIPA_MULTI = {key: rep for key, rep in TIPA_MAP.items() if len(key) > 1}
+TIPA_SINGLE = str.maketrans({key: rep for key, rep in TIPA_MAP.items() if len(key) == 1})
+TIPA_MULTI_REGEX = re.compile(alternation_pattern(TIPA_MULTI))
+I_TO_J_REGEX = re.compile(f"i(?=[{re.escape(VOWELS)}])")
+
+# An external macro, or a whole \textipa{...} block. Macros inside the block are
+# skipped as units (their braces do not close it); the lookahead + backreference
+# keeps the block body atomic, so braces inside macros are never used as a fallback
+LATEX_REGEX = re.compile(
+    rf"(?P<macro>{EXTERNAL_MACROS_PATTERN})"
+    rf"|\\textipa\{{(?=(?P<inner>(?:{EXTERNAL_MACROS_PATTERN}|[^}}])*))(?P=inner)\}}"
+)
+
 # === Convert TIPA blocks to IPA characters ===
 
 def replace_external_macros(text):
-    for macro, rep in EXTERNAL_MACROS.items():
-        text = text.replace(macro, rep)
-    return text
+    return EXTERNAL_MACROS_REGEX.sub(lambda m: EXTERNAL_MACROS[m.group(0)], text)
 
 # If "i" is before a vowel -> change for "j" (according to Polish pronunciation)
 def contextual_i_to_j(text):
-    result = []
-    for i, ch in enumerate(text):
-        if ch == "i" and i + 1 < len(text) and text[i+1] in VOWELS:
-            result.append("j")
-        else:
-            result.append(ch)
-    return "".join(result)
+    return I_TO_J_REGEX.sub("j", text)
 
 
 def replace_tipa_in_block(tipa_text):
-    keys = sorted(TIPA_MAP.keys(), key=len, reverse=True)
-    for key in keys:
-        tipa_text = tipa_text.replace(key, TIPA_MAP[key])
+    # Longer sequences first (as before), then the single characters they do not cover
+    tipa_text = TIPA_MULTI_REGEX.sub(lambda m: TIPA_MULTI[m.group(0)], tipa_text)
+    tipa_text = tipa_text.translate(TIPA_SINGLE)
     return contextual_i_to_j(tipa_text)
 
 
-def process_tipa_blocks(text):
-    pattern = r"(\\textipa\{([^}]*)\})"
-
+def clean_latex(text):
+    """Replace external macros and convert \\textipa{...} blocks to IPA in a single pass."""
     def repl(match):
-        inner = match.group(2)
-        return replace_tipa_in_block(inner)
+        if match.group("macro"):
+            return EXTERNAL_MACROS[match.group("macro")]
+        return replace_tipa_in_block(replace_external_macros(match.group("inner")))
 
-    return re.sub(pattern, repl, text)
+    return LATEX_REGEX.sub(repl, text)
 
 # === PANDOC : convert .tex to .md file ===
 
-def run_pandoc(input_tex, output_md, bibfile, cwd):
+def run_pandoc(latex_text, output_md, bibfile, cwd):
+    """Convert LaTeX passed on stdin; cwd is where Pandoc resolves \\input files and the bibliography."""
     cmd = [
         "pandoc",
-        input_tex,
         "--from=latex",
         "--to=markdown",
         "--output", output_md,
@@ -101,10 +115,17 @@ def run_pandoc(input_tex, output_md, bibfile, cwd):
     print(f"\nRunning Pandoc in folder: {cwd}")
     print(" ".join(cmd))
 
-    subprocess.run(cmd, cwd=cwd, check=True)
+    subprocess.run(cmd, input=latex_text.encode("utf-8"), cwd=cwd, check=True)
 
 # === Main ===
 
+def load_file(path):
+    """Read a UTF-8 file through mmap, decoding straight from the page cache (no intermediate bytes copy)."""
+    if os.path.getsize(path) == 0:
+        return ""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return str(mm, "utf-8")
+
 def main():
     # Determine folders
     script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -118,34 +139,20 @@ def main():
 
     # Filenames
     input_tex = "modele.tex"
-    cleaned_tex = "cleaned_ipa.tex"
     output_md = "main_with_noise.md"
     bib = "biblio.bib"
 
     input_tex_path = os.path.join(raw_dir, input_tex)
 
     # Load original LaTeX
-    with open(input_tex_path, "r", encoding="utf-8") as f:
-        text = f.read()
-
-    # External macros
-    text = replace_external_macros(text)
-
-    # Replace TIPA blocks
-    text = process_tipa_blocks(text)
-
-    # Write cleaned LaTeX to intermediate/
-    cleaned_path = os.path.join(inter_dir, cleaned_tex)
-    with open(cleaned_path, "w", encoding="utf-8") as f:
-        f.write(text)
+    text = load_file(input_tex_path)
 
-    # Copy cleaned file back to raw/
-    cleaned_for_pandoc = os.path.join(raw_dir, cleaned_tex)
-    shutil.copy(cleaned_path, cleaned_for_pandoc)
+    # External macros and TIPA blocks
+    text = clean_latex(text)
 
-    # Run Pandoc, output directly to final/
+    # Run Pandoc on the cleaned LaTeX (kept in memory), output to intermediate/
     run_pandoc(
-        input_tex=cleaned_tex,
+        latex_text=text,
         output_md=os.path.join(inter_dir, output_md),
         bibfile=bib,
         cwd=raw_dir
@@ -155,7 +162,6 @@ def main():
     shutil.copy(os.path.join(raw_dir, bib), os.path.join(final_dir, bib))
 
     print("\nFiles generated:")
-    print(f"- cleaned LaTeX:   {cleaned_path}")
     print(f"- Markdown:        {os.path.join(inter_dir, output_md)}")
     print(f"- Bibliography:    {os.path.join(final_dir, bib)}")
 